@@ -8,38 +8,46 @@ import json
 import logging
 import os
 import argparse
+import re
+import sys
 from datetime import datetime
-from collections import Counter
-import io
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
+
+from zip_window import open_nested_zip
+
+try:
+    import orjson
+except ImportError:  # optional speedup; fall back to stdlib json
+    orjson = None
+
+
+# Resolved once at import: Path.resolve() is a realpath syscall
+_SCRIPT_DIR = Path(__file__).resolve().parent
+_REPO_ROOT = _SCRIPT_DIR.parents[1] if len(_SCRIPT_DIR.parents) >= 2 else _SCRIPT_DIR
 
 
 def resolve_raw_root(cli_path: str | None) -> Path:
-    # 1) CLI argument
-    if cli_path:
-        p = Path(cli_path)
-        if p.exists():
-            return p
-        return p
+    # 1) CLI argument, 2) environment variable. Used as given even when
+    #    missing, so main() reports the path the user actually asked for.
+    return _resolve_raw_root(cli_path or os.environ.get("FIRSTDATA_PATH"))
 
-    # 2) Environment variable
-    env = os.environ.get("FIRSTDATA_PATH")
-    if env:
-        p = Path(env)
-        if p.exists():
-            return p
-        return p
 
-    # 3) Same directory as script
-    here = Path(__file__).resolve()
-    p = here.parent / "FirstData"
-    if p.exists():
-        return p
+@lru_cache(maxsize=4)
+def _resolve_raw_root(explicit: str | None) -> Path:
+    if explicit:
+        return Path(explicit)
 
+    # 3) Same directory as script
     # 4) Repository-relative: file -> etl -> backend -> repo
-    repo_root = here.parents[2] if len(here.parents) >= 3 else here.parent
-    p = repo_root / "FirstData"
-    if p.exists():
-        return p
+    for p in (_SCRIPT_DIR / "FirstData", _REPO_ROOT / "FirstData"):
+        if p.exists():
+            return p
 
     # 5) Legacy: CWD-relative
     return Path("FirstData")
@@ -60,134 +68,195 @@ MANIFEST_PATH = TMP / "manifest.json"
 
 DATA_EXT = {".txt", ".csv", ".parquet", ".pq"}
 
+# Directories never holding stock data; not descended into
+SKIP_DIRS = frozenset({"__MACOSX", ".git"})
 
-def extract_tags_from_filename(filename: str):
+# Threads per archive for inflating nested company zips
+NESTED_ZIP_WORKERS = 4
+
+
+def extract_tag_from_filename(filename: str) -> str:
     """
     Extract ticker symbol (everything before first underscore) as the tag.
     Example: AACT_full_5min_adjsplitdiv.txt -> 'AACT'
+    Returns '' when the filename has no tag.
+    """
+    # Single scan, no temporary lists: stop at the first "_" before the last "."
+    end = filename.rfind(".")
+    if end < 0:
+        end = len(filename)
+    under = filename.find("_", 0, end)
+    tag = filename[:under] if under >= 0 else filename[:end]
+    # Tickers repeat across intervals and archives: share one string object
+    return sys.intern(tag) if tag else ""
+
+
+def _scandir_recursive(path):
+    """
+    Yield every file under `path` as an os.DirEntry.
+    Entry types come from the directory read itself, so no extra stat() per file.
+    Metadata folders (SKIP_DIRS) and macOS ._ files are pruned during the walk.
+    Symlinked directories are not descended into (as with rglob, this avoids
+    loops), but symlinked files are yielded like regular ones.
     """
-    name = filename.rsplit(".", 1)[0]
-    tag = name.split("_")[0]
-    return [tag] if tag else []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith("._"):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    yield from _scandir_recursive(entry.path)
+            elif entry.is_file():
+                yield entry
 
 
 def discover_files(raw_root):
     # Find all TXT, CSV, etc and ZIP archives in all interval subfolders, recursively.
-    items = []
-    for interval_dir in sorted(raw_root.iterdir()):
-        interval = interval_dir.name
-        if interval_dir.is_dir():
-            for file_path in interval_dir.rglob("*"):
-                path = str(file_path)
-                fileType = "." + path.split(".")[-1]
+    # Yields (kind, interval, entry) lazily so archive scans can start while the
+    # rest of the tree is still being walked.
+    with os.scandir(raw_root) as it:
+        top_entries = sorted(it, key=lambda e: e.name)
+
+    for top in top_entries:
+        if top.is_dir():
+            # Metadata folders directly under the root are not intervals
+            if top.name in SKIP_DIRS:
+                continue
+            interval = sys.intern(top.name)
+            # Single pass over the tree: classify each entry by its extension once
+            for entry in _scandir_recursive(top.path):
+                fileType = "." + entry.name.lower().rpartition(".")[2]
                 if fileType in DATA_EXT:
-                    items.append(("raw", interval, file_path))
+                    # Keep the DirEntry so its stat() is reused for size_bytes
+                    yield ("raw", interval, entry)
                 elif fileType == ".zip":
-                    items.append(("archive", interval, file_path))
+                    yield ("archive", interval, entry.path)
 
-        elif interval_dir.is_file():
-            # Top-level file. If it's a zip, treat it as an archive with interval = stem
-            if interval_dir.suffix.lower() == ".zip" or zipfile.is_zipfile(interval_dir):
-                interval = interval_dir.stem
-                items.append(("archive", interval, interval_dir))
+        elif top.is_file() and not top.name.startswith("._"):
+            fileType = "." + top.name.lower().rpartition(".")[2]
             # Top-level raw files e.g. AAPL_full_1hour_adjsplitdiv.txt directly at raw_root
-            elif interval_dir.suffix.lower() in DATA_EXT:
+            if fileType in DATA_EXT:
                 # Interval unknown from filename -- set to empty for now
-                items.append(("raw", "", interval_dir))
+                yield ("raw", "", top)
+            # Top-level zip, treat it as an archive with interval = stem. Only
+            # files without a known suffix pay for the is_zipfile() open + read.
+            elif fileType == ".zip" or zipfile.is_zipfile(top.path):
+                interval = sys.intern(os.path.splitext(top.name)[0])
+                yield ("archive", interval, top.path)
 
-    return items
 
+# Zip member filters, compiled once and applied in a single pass over infolist()
+_DATA_RE = re.compile(r"(?i)\.(csv|txt|csv\.gz|txt\.gz|parquet)$")
+_ZIP_RE = re.compile(r"(?i)\.zip$")
+# macOS resource entries (__MACOSX/ folders, ._ AppleDouble files) are never data
+_SKIP_RE = re.compile(r"(?i)(^|/)(__macosx|\._)")
 
-def _is_data_name(name: str) -> bool:
-    n = name.lower()
-    return (
-        n.endswith(".csv")
-        or n.endswith(".txt")
-        or n.endswith(".csv.gz")
-        or n.endswith(".txt.gz")
-        or n.endswith(".parquet")
-    )
 
-
-def _looks_like_real_zip(name: str) -> bool:
-    """
-    True only for actual nested company zips, false for macOS resource files etc.
-    """
-    n = name.lower()
-    if "__macosx" in n:
-        return False
-    if n.startswith("._"):
-        return False
-    return n.endswith(".zip")
-
-
-def process_zip_archive(
-    archive_path: Path,
-    interval: str,
-    manifest_files: list[dict],
-    all_tags: list[str],
-) -> None:
+def scan_archive(archive_path: str, interval: str) -> tuple[list[dict], Counter]:
     """
     Read inner files directly from a ZIP archive, without extracting to disk.
     Handles:
       - Data files directly in the archive
       - Nested company ZIP files inside the archive
+
+    Returns (manifest_files, tag_counts) for this archive only, so archives can
+    be scanned independently in worker processes.
     """
+    manifest_files = []
+    tag_counts = Counter()
+    # Every row of this archive shares the same interval and archive strings
+    interval = sys.intern(interval)
+    archive_name = sys.intern(os.path.basename(archive_path))
     try:
         with zipfile.ZipFile(archive_path, "r") as zf:
+            # Classify every member once: nested company zips vs data files
+            nested_infos = []
+            data_infos = []
             for info in zf.infolist():
                 name = info.filename
-
-                # Skip directories
-                if name.endswith("/"):
-                    continue
-
-                # Nested company zip inside interval zip
-                if _looks_like_real_zip(name):
-                    try:
-                        nested_bytes = zf.read(info)
-                        with zipfile.ZipFile(io.BytesIO(nested_bytes), "r") as nested_zf:
-                            for nested_info in nested_zf.infolist():
-                                nested_name = nested_info.filename
-                                if nested_name.endswith("/"):
-                                    continue
-                                if not _is_data_name(nested_name):
-                                    continue
-
-                                tags = extract_tags_from_filename(Path(nested_name).name)
-                                all_tags.extend(tags)
-                                manifest_files.append(
-                                    {
-                                        # Virtual path: outer.zip!inner.zip!file
-                                        "path": f"{archive_path}!{name}!{nested_name}",
-                                        "size_bytes": nested_info.file_size,
-                                        "interval": interval,
-                                        "archive": archive_path.name,
-                                        "filename": Path(nested_name).name,
-                                        "tags": tags,
-                                    }
-                                )
-                    except Exception:
-                        logger.exception(
-                            f"Failed processing nested zip in {archive_path}: {name}"
-                        )
+                if name.endswith("/") or _SKIP_RE.search(name):
                     continue
-
-                # Regular data file directly inside the archive
-                if not _is_data_name(name):
-                    continue
-
-                tags = extract_tags_from_filename(Path(name).name)
-                all_tags.extend(tags)
+                if _ZIP_RE.search(name):
+                    nested_infos.append(info)
+                elif _DATA_RE.search(name):
+                    data_infos.append(info)
+
+            # Nested company zips inside interval zip. Inflating them runs in
+            # zlib with the GIL released, so overlap them on a thread pool.
+            # ZipFile is not safe for concurrent reads: each thread opens its
+            # own handle on the outer archive, plus one reusable spool buffer
+            # for deflated nested zips.
+            local = threading.local()
+            handles = []
+
+            def list_nested(info):
+                try:
+                    nested_outer = getattr(local, "zf", None)
+                    if nested_outer is None:
+                        local.fp = open(archive_path, "rb")
+                        handles.append(local.fp)
+                        nested_outer = local.zf = zipfile.ZipFile(local.fp, "r")
+                        local.spool = tempfile.SpooledTemporaryFile(max_size=16 << 20)
+                        handles.extend((nested_outer, local.spool))
+                    nested = open_nested_zip(nested_outer, local.fp, info, local.spool)
+                    with nested as (nested_zf, _):
+                        return [
+                            nested_info
+                            for nested_info in nested_zf.infolist()
+                            if not nested_info.filename.endswith("/")
+                            and not _SKIP_RE.search(nested_info.filename)
+                            and _DATA_RE.search(nested_info.filename)
+                        ]
+                except Exception:
+                    logger.exception(
+                        f"Failed processing nested zip in {archive_path}: {info.filename}"
+                    )
+                    return []
+
+            try:
+                with ThreadPoolExecutor(max_workers=NESTED_ZIP_WORKERS) as pool:
+                    nested_results = list(pool.map(list_nested, nested_infos))
+            finally:
+                # Reversed: each ZipFile closes before the file it reads from
+                for handle in reversed(handles):
+                    handle.close()
+
+            for info, nested_data in zip(nested_infos, nested_results):
+                name = info.filename
+                for nested_info in nested_data:
+                    nested_name = nested_info.filename
+                    base = nested_name.rpartition("/")[2]
+                    tag = extract_tag_from_filename(base)
+                    if tag:
+                        tag_counts[tag] += 1
+                    manifest_files.append(
+                        {
+                            # Virtual path: outer.zip!inner.zip!file
+                            "path": f"{archive_path}!{name}!{nested_name}",
+                            "size_bytes": nested_info.file_size,
+                            "interval": interval,
+                            "archive": archive_name,
+                            "filename": base,
+                            "tags": [tag] if tag else [],
+                        }
+                    )
+
+            # Regular data files directly inside the archive
+            for info in data_infos:
+                name = info.filename
+                base = name.rpartition("/")[2]
+                tag = extract_tag_from_filename(base)
+                if tag:
+                    tag_counts[tag] += 1
                 manifest_files.append(
                     {
                         # Virtual path: outer.zip!file
                         "path": f"{archive_path}!{name}",
                         "size_bytes": info.file_size,
                         "interval": interval,
-                        "archive": archive_path.name,
-                        "filename": Path(name).name,
-                        "tags": tags,
+                        "archive": archive_name,
+                        "filename": base,
+                        "tags": [tag] if tag else [],
                     }
                 )
     except zipfile.BadZipFile:
@@ -195,6 +264,53 @@ def process_zip_archive(
     except Exception as e:
         logger.error(f"Error reading archive {archive_path}: {e}")
 
+    return manifest_files, tag_counts
+
+
+def _json_bytes(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+@contextmanager
+def write_manifest(manifest_path: Path, tag_counts: Counter):
+    """
+    Stream manifest.json to disk one file entry at a time.
+    Yields write_file(entry); all_tags and tag_counts are written from
+    `tag_counts` on exit. The document is built in a temp file that only
+    replaces `manifest_path` once it is complete.
+    """
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    n_written = 0
+
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(b'{\n  "created_at": ')
+            f.write(_json_bytes(datetime.now().isoformat()))
+            f.write(b',\n  "files": [')
+
+            def write_file(entry: dict) -> None:
+                nonlocal n_written
+                f.write(b"\n    " if n_written == 0 else b",\n    ")
+                f.write(_json_bytes(entry))
+                n_written += 1
+
+            yield write_file
+
+            f.write(b'\n  ],\n  "all_tags": ')
+            f.write(_json_bytes(sorted(tag_counts)))
+            f.write(b',\n  "tag_counts": ')
+            f.write(_json_bytes(dict(tag_counts)))
+            f.write(b"\n}\n")
+
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        # Failed or interrupted run (including Ctrl-C): don't leave a partial
+        # manifest behind; any previous manifest.json stays untouched
+        tmp_path.unlink(missing_ok=True)
+        raise
+
 
 def main():
     parser = argparse.ArgumentParser(description="Ingest stock data and create manifest")
@@ -219,55 +335,76 @@ def main():
     logger.info("=" * 60)
 
     items = discover_files(RAW_ROOT)
+    first_item = next(items, None)
 
-    if not items:
+    if first_item is None:
         logger.warning("No TXT/CSV or ZIP files found!")
         return
 
-    manifest_files = []
-    all_tags = []
+    tag_counts = Counter()
+    n_files = 0
+
+    # Rows go to disk as soon as they are produced; only the tag summary and
+    # rows queued behind a still-running archive scan are kept in memory.
+    with write_manifest(MANIFEST_PATH, tag_counts) as write_file:
+        # Archives are independent: scan each one in its own worker process,
+        # submitted as soon as discovery reaches it
+        with ProcessPoolExecutor() as ex:
+            # Raw rows and archive futures in discovery order. Rows and tag
+            # counts are only taken from the head, so both the files list and
+            # tag_counts' key order are deterministic and match the walk.
+            pending = deque()
+
+            def write_ready(wait: bool) -> None:
+                # popleft() drops each future, and with it its rows, as soon
+                # as they are written
+                nonlocal n_files
+                while pending and (
+                    wait or not isinstance(pending[0], Future) or pending[0].done()
+                ):
+                    item = pending.popleft()
+                    if isinstance(item, Future):
+                        archive_files, archive_tag_counts = item.result()
+                        for entry in archive_files:
+                            write_file(entry)
+                        n_files += len(archive_files)
+                        tag_counts.update(archive_tag_counts)
+                    else:
+                        write_file(item)
+                        n_files += 1
+                        tag_counts.update(item["tags"])
+
+            for item_type, interval, path in chain([first_item], items):
+                if item_type == "archive":
+                    pending.append(ex.submit(scan_archive, path, interval))
+
+                elif item_type == "raw":
+                    # `path` is the os.DirEntry from discovery; its stat() is cached
+                    tag = extract_tag_from_filename(path.name)
+                    pending.append(
+                        {
+                            "path": os.fspath(path),
+                            "size_bytes": path.stat().st_size,
+                            "interval": interval,
+                            "archive": None,
+                            "filename": path.name,
+                            "tags": [tag] if tag else [],
+                        }
+                    )
+
+                # Write whatever is ready while discovery is still running
+                write_ready(wait=False)
 
-    for item_type, interval, path in items:
-        if item_type == "archive":
             # Read archive contents directly (no extract to TMP)
-            process_zip_archive(path, interval, manifest_files, all_tags)
-
-        elif item_type == "raw":
-            tags = extract_tags_from_filename(path.name)
-            all_tags.extend(tags)
-
-            manifest_files.append(
-                {
-                    "path": str(path),
-                    "size_bytes": path.stat().st_size,
-                    "interval": interval,
-                    "archive": None,
-                    "filename": path.name,
-                    "tags": tags,
-                }
-            )
-
-    # Get unique tags and counts
-    tag_counts = Counter(all_tags)
-    unique_tags = sorted(tag_counts.keys())
-
-    # Write manifest
-    manifest = {
-        "created_at": datetime.now().isoformat(),
-        "files": manifest_files,
-        "all_tags": unique_tags,
-        "tag_counts": dict(tag_counts),
-    }
-    with open(MANIFEST_PATH, "w") as f:
-        json.dump(manifest, f, indent=2)
-
-    logger.info(f"Manifest created with {len(manifest['files'])} files")
-    logger.info(f"Found {len(unique_tags)} unique tags (ticker symbols)")
+            write_ready(wait=True)
+
+    logger.info(f"Manifest created with {n_files} files")
+    logger.info(f"Found {len(tag_counts)} unique tags (ticker symbols)")
     logger.info(f"Top 10 tickers: {tag_counts.most_common(10)}")
     logger.info(f"Manifest saved to: {MANIFEST_PATH}")
 
     logger.info("=" * 60)
-    logger.info(f"Ingestion complete: {len(manifest_files)} files indexed")
+    logger.info(f"Ingestion complete: {n_files} files indexed")
     logger.info("=" * 60)
 
 
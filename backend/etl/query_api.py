@@ -4,7 +4,17 @@ import pandas as pd
 import json
 import zipfile
 from pathlib import Path
-import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
+from zip_window import open_nested_zip
+
+try:
+    import orjson
+except ImportError:  # optional speedup; fall back to stdlib json
+    orjson = None
 
 app = Flask(__name__)
 
@@ -16,8 +26,17 @@ def after_request(response):
     response.headers.add("Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS")
     return response
 
-with open("etl_tmp/manifest.json") as f:
-    manifest = json.load(f)
+# Keep the raw bytes: /api/manifest serves them as-is instead of re-encoding
+with open("etl_tmp/manifest.json", "rb") as f:
+    manifest_bytes = f.read()
+manifest = orjson.loads(manifest_bytes) if orjson is not None else json.loads(manifest_bytes)
+
+# (SYMBOL, interval) -> first matching manifest entry, so requests don't
+# rescan the file list. setdefault keeps the first entry, as the old scan did.
+file_index = {}
+for entry in manifest["files"]:
+    for tag in entry.get("tags", []):
+        file_index.setdefault((tag.upper(), entry["interval"]), entry)
 
 @app.route("/api/test")
 def test_proxy():
@@ -25,7 +44,30 @@ def test_proxy():
 
 @app.route("/api/manifest")
 def get_manifest():
-    return jsonify(manifest)
+    return app.response_class(manifest_bytes, mimetype="application/json")
+
+BAR_COLUMNS = ["time", "open", "high", "low", "close", "volume"]
+
+# Declared up front so read_csv skips per-column type inference; time stays a
+# string for the single to_datetime pass in _load_bars, once per cached file
+BAR_DTYPES = {
+    "time": str,
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+}
+
+def _read_bars(source, memory_map=False):
+    """Read a headerless OHLCV bar file (path or open file object)."""
+    return pd.read_csv(
+        source,
+        header=None,
+        names=BAR_COLUMNS,
+        dtype=BAR_DTYPES,
+        delimiter=",",
+        memory_map=memory_map,
+    )
 
 def load_csv_from_manifest_entry(file_meta):
     """
@@ -39,59 +81,95 @@ def load_csv_from_manifest_entry(file_meta):
     """
     path = file_meta["path"]
 
-    # Case 1: no '!' -> regular file path on disk
+    # Case 1: no '!' -> regular file path on disk; map it so the parser
+    # reads straight from the page cache
     if "!" not in path:
-        return pd.read_csv(
-            path,
-            header=None,
-            names=["time", "open", "high", "low", "close", "volume"],
-            delimiter=",",
-        )
+        return _read_bars(path, memory_map=True)
 
     # Case 2: one or more '!' -> zip layers
     parts = path.split("!")
     outer_zip_path = Path(parts[0])
     inner_parts = parts[1:]  # e.g. ["inner.zip", "data.txt"] or ["data.txt"]
 
-    # Open the outermost zip
-    with zipfile.ZipFile(outer_zip_path, "r") as zf:
+    with ExitStack() as stack:
+        # Open the outermost zip on a raw handle the nested layers read through
+        fp = stack.enter_context(open(outer_zip_path, "rb"))
+        zf = stack.enter_context(zipfile.ZipFile(fp, "r"))
 
         # If there are nested zips, walk down until the last zip layer
-        current_bytes = None
-        for i, inner_name in enumerate(inner_parts):
-            inner_name = inner_name.lstrip("/")  # normalize
-
-            # Last part -> should be the actual data file
-            if i == len(inner_parts) - 1:
-                # If we already opened nested zips, read from that
-                if current_bytes is not None:
-                    with zipfile.ZipFile(io.BytesIO(current_bytes), "r") as last_zf:
-                        with last_zf.open(inner_name, "r") as f:
-                            return pd.read_csv(
-                                f,
-                                header=None,
-                                names=["time", "open", "high", "low", "close", "volume"],
-                                delimiter=",",
-                            )
-                else:
-                    # Data file directly inside outer zip
-                    with zf.open(inner_name, "r") as f:
-                        return pd.read_csv(
-                            f,
-                            header=None,
-                            names=["time", "open", "high", "low", "close", "volume"],
-                            delimiter=",",
-                        )
-
-            # Not last -> treat as nested zip
-            if current_bytes is None:
-                current_bytes = zf.read(inner_name)
-            else:
-                with zipfile.ZipFile(io.BytesIO(current_bytes), "r") as nested_zf:
-                    current_bytes = nested_zf.read(inner_name)
-
-    # Fallback: should not reach here if manifest paths are correct
-    raise FileNotFoundError(f"Could not resolve nested path: {path}")
+        for inner_name in inner_parts[:-1]:
+            info = zf.getinfo(inner_name.lstrip("/"))
+            spool = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=16 << 20))
+            zf, fp = stack.enter_context(open_nested_zip(zf, fp, info, spool))
+
+        # Last part -> the actual data file, read straight from its layer
+        with zf.open(inner_parts[-1].lstrip("/"), "r") as f:
+            return _read_bars(f)
+
+# Number of parsed bar files kept in memory between requests
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE", 256))
+
+def load_bars(path):
+    """
+    Parsed bars for a manifest path, with `time` already converted.
+
+    Cached so repeat queries skip the zip inflation and CSV parse. The key
+    includes the on-disk file's mtime (the outer zip for virtual paths), so
+    a file rewritten by a fresh ingest is parsed again rather than served
+    stale. Callers must not modify the returned frame.
+    """
+    disk_path = path.split("!", 1)[0]
+    return _load_bars(path, os.stat(disk_path).st_mtime_ns)
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _load_bars(path, mtime_ns):
+    df = load_csv_from_manifest_entry({"path": path})
+    # ISO8601 takes pandas' fast ISO path instead of guessing a format, and
+    # accepts date-only (daily bars) and date+time rows alike
+    df["time"] = pd.to_datetime(df["time"], format="ISO8601")
+    # Checked once per file so every query can pick the cheaper date filter
+    df.attrs["time_sorted"] = df["time"].is_monotonic_increasing
+    return df
+
+def query_symbol(symbol, interval, dt_from, dt_to, metrics):
+    """
+    Load one symbol's bars for `interval`, filtered to the date range.
+
+    Returns the requested columns as a DataFrame, or None if no file matches.
+    """
+    sym_norm = symbol.upper()
+    file_meta = file_index.get((sym_norm, interval))
+
+    if file_meta is None:
+        print(f"No file match found for symbol={symbol} interval={interval}")
+        return None
+
+    print(f"Using file for {symbol}: {file_meta['path']}")
+
+    # Shared cached frame: filter into a new frame before adding columns
+    df = load_bars(file_meta["path"])
+
+    if df.attrs.get("time_sorted"):
+        # Bars in time order: binary-search both bounds and take one slice
+        # instead of comparing every row
+        times = df["time"]
+        lo = times.searchsorted(dt_from, side="left") if dt_from is not None else 0
+        hi = times.searchsorted(dt_to, side="right") if dt_to is not None else len(df)
+        df = df.iloc[lo:hi]
+    elif dt_from is not None or dt_to is not None:
+        # Build one mask so the frame is copied once, not once per bound
+        mask = pd.Series(True, index=df.index)
+        if dt_from is not None:
+            mask &= df["time"] >= dt_from
+        if dt_to is not None:
+            mask &= df["time"] <= dt_to
+        df = df[mask]
+
+    df = df.assign(symbol=sym_norm)
+    fields = ["time", "symbol"] + [m for m in metrics if m in df.columns]
+
+    # Remove the 500-row cap so full range is returned
+    return df[fields]  # [web:170]
 
 @app.route("/api/query_stock")
 def query_stock():
@@ -119,47 +197,41 @@ def query_stock():
     dt_from = pd.to_datetime(date_from) if date_from else None
     dt_to = pd.to_datetime(date_to) if date_to else None  # [web:164]
 
-    all_results = []
-
-    for symbol in symbols:
-        sym_norm = symbol.upper()
-        matches = [
-            f
-            for f in manifest["files"]
-            if (
-                sym_norm in [t.upper() for t in f.get("tags", [])]
-                and f["interval"] == interval
-            )
-        ]
-
-        if not matches:
-            print(f"No file match found for symbol={symbol} interval={interval}")
-            continue
-
-        file_meta = matches[0]
-        print(f"Using file for {symbol}: {file_meta['path']}")
-
-        # Use helper that understands zip paths
-        df = load_csv_from_manifest_entry(file_meta)
-
-        df["time"] = pd.to_datetime(df["time"])
-        df["symbol"] = sym_norm
-
-        if dt_from is not None:
-            df = df[df["time"] >= dt_from]
-        if dt_to is not None:
-            df = df[df["time"] <= dt_to]
-
-        fields = ["time", "symbol"] + [m for m in metrics if m in df.columns]
-
-        # Remove the 500-row cap so full range is returned
-        result = df[fields].to_dict(orient="records")  # [web:170]
-        all_results.extend(result)
-
-    if not all_results:
+    # Symbols are independent; file reads and CSV parsing release the GIL
+    frames = []
+    if symbols:
+        with ThreadPoolExecutor(max_workers=min(len(symbols), os.cpu_count() or 1)) as ex:
+            frames = [
+                df
+                for df in ex.map(
+                    lambda symbol: query_symbol(symbol, interval, dt_from, dt_to, metrics),
+                    symbols,
+                )
+                if df is not None and not df.empty
+            ]
+
+    if not frames:
         return jsonify({"error": "No matching data file."}), 404
 
-    return jsonify(all_results)
+    # Encode every symbol before the response starts, so an encoding error is
+    # still a 500 rather than a 200 with a truncated array. Each symbol's row
+    # dicts are dropped once encoded, and the pieces are streamed rather than
+    # joined into one more copy of the body. app.json keeps jsonify's value
+    # formatting; the separators match its compact output.
+    parts = [
+        app.json.dumps(df.to_dict(orient="records"), separators=(",", ":"))[1:-1]
+        for df in frames
+    ]
+
+    def generate():
+        yield "["
+        for i, part in enumerate(parts):
+            if i:
+                yield ","
+            yield part
+        yield "]\n"
+
+    return app.response_class(generate(), mimetype="application/json")
 
 @app.route("/")
 def home():
@@ -0,0 +1,64 @@
+import importlib.util
+import json
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+ETL_DIR = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    # 0_ingest.py is not an importable module name, and it creates etl_tmp/
+    # in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(ETL_DIR))
+    spec = importlib.util.spec_from_file_location("ingest", ETL_DIR / "0_ingest.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _entry(i):
+    return {
+        "path": f"/data/1hour.zip!T{i}_full_1hour.txt",
+        "size_bytes": 100 + i,
+        "interval": "1hour",
+        "archive": "1hour.zip",
+        "filename": f"T{i}_full_1hour.txt",
+        "tags": [f"T{i}"],
+    }
+
+
+@pytest.mark.parametrize("n_entries", [0, 1, 5])
+def test_write_manifest_round_trips(ingest, tmp_path, n_entries):
+    manifest_path = tmp_path / "manifest.json"
+    entries = [_entry(i) for i in range(n_entries)]
+    tag_counts = Counter()
+
+    with ingest.write_manifest(manifest_path, tag_counts) as write_file:
+        for entry in entries:
+            write_file(entry)
+            tag_counts.update(entry["tags"])
+
+    manifest = json.loads(manifest_path.read_text())
+    assert set(manifest) == {"created_at", "files", "all_tags", "tag_counts"}
+    assert manifest["files"] == entries
+    assert manifest["all_tags"] == sorted(tag_counts)
+    assert manifest["tag_counts"] == dict(tag_counts)
+    assert not (tmp_path / "manifest.json.tmp").exists()
+
+
+@pytest.mark.parametrize("error", [RuntimeError, KeyboardInterrupt])
+def test_write_manifest_failure_keeps_previous_manifest(ingest, tmp_path, error):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text("previous")
+
+    with pytest.raises(error):
+        with ingest.write_manifest(manifest_path, Counter()) as write_file:
+            write_file(_entry(0))
+            raise error
+
+    assert manifest_path.read_text() == "previous"
+    assert not (tmp_path / "manifest.json.tmp").exists()
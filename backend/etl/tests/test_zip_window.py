@@ -0,0 +1,208 @@
+import importlib.util
+import io
+import json
+import struct
+import sys
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+
+import pytest
+
+ETL_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ETL_DIR))
+
+from zip_window import ZipMemberWindow, open_nested_zip  # noqa: E402
+
+BARS = b"".join(
+    b"2005-01-03 09:%02d:00,1.0,2.0,0.5,1.5,%d\n" % (minute, 100 + minute)
+    for minute in range(30, 60, 5)
+)
+
+
+def _zip_bytes(members, compression=zipfile.ZIP_STORED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def _outer(tmp_path, data, compression=zipfile.ZIP_STORED):
+    path = tmp_path / "outer.zip"
+    path.write_bytes(_zip_bytes({"nested.zip": data}, compression))
+    return path
+
+
+def _zipcrypto_zip(name, data, pwd):
+    """
+    Single stored member encrypted with traditional PKWARE encryption, built
+    by hand since zipfile can only decrypt it.
+    """
+    crc = zlib.crc32(data)
+    keys = [0x12345678, 0x23456789, 0x34567890]
+
+    def crc_byte(value, b):
+        return zlib.crc32(bytes([b]), value ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+    def update(b):
+        keys[0] = crc_byte(keys[0], b)
+        keys[1] = ((keys[1] + (keys[0] & 0xFF)) * 134775813 + 1) & 0xFFFFFFFF
+        keys[2] = crc_byte(keys[2], keys[1] >> 24)
+
+    for b in pwd:
+        update(b)
+    encrypted = bytearray()
+    # 12-byte encryption header; its last byte is the CRC check byte
+    for b in bytes(11) + bytes([crc >> 24]) + data:
+        k = keys[2] | 2
+        encrypted.append(b ^ (((k * (k ^ 1)) >> 8) & 0xFF))
+        update(b)
+
+    name = name.encode()
+    sizes = (crc, len(encrypted), len(data), len(name))
+    local = struct.pack("<4s5H3L2H", b"PK\x03\x04", 20, 0x1, 0, 0, 0x21, *sizes, 0)
+    central = struct.pack(
+        "<4s6H3L5H2L", b"PK\x01\x02", 20, 20, 0x1, 0, 0, 0x21, *sizes, 0, 0, 0, 0, 0, 0
+    )
+    body = local + name + encrypted
+    end = struct.pack(
+        "<4s4H2LH", b"PK\x05\x06", 0, 0, 1, 1, len(central) + len(name), len(body), 0
+    )
+    return body + central + name + end
+
+
+def _list_nested(outer_path, name="nested.zip"):
+    with open(outer_path, "rb") as fp, zipfile.ZipFile(fp) as zf:
+        with tempfile.SpooledTemporaryFile() as spool:
+            with open_nested_zip(zf, fp, zf.getinfo(name), spool) as (nested_zf, _):
+                return nested_zf.namelist()
+
+
+def test_stored_nested_zip_reads_through_window(tmp_path):
+    nested = _zip_bytes({"A_full_5min.txt": BARS, "B_full_5min.txt": BARS * 2})
+    outer_path = _outer(tmp_path, nested)
+
+    with open(outer_path, "rb") as fp, zipfile.ZipFile(fp) as zf:
+        with tempfile.SpooledTemporaryFile() as spool:
+            info = zf.getinfo("nested.zip")
+            with open_nested_zip(zf, fp, info, spool) as (nested_zf, nested_fp):
+                assert isinstance(nested_fp, ZipMemberWindow)
+                assert nested_zf.namelist() == ["A_full_5min.txt", "B_full_5min.txt"]
+                assert nested_zf.read("B_full_5min.txt") == BARS * 2
+            # Read in place: nothing was inflated into the spool
+            assert spool.tell() == 0 and not spool.read()
+
+
+def test_deflated_nested_zip_is_inflated_into_spool(tmp_path):
+    nested = _zip_bytes({"A_full_5min.txt": BARS})
+    outer_path = _outer(tmp_path, nested, zipfile.ZIP_DEFLATED)
+
+    with open(outer_path, "rb") as fp, zipfile.ZipFile(fp) as zf:
+        with tempfile.SpooledTemporaryFile() as spool:
+            info = zf.getinfo("nested.zip")
+            with open_nested_zip(zf, fp, info, spool) as (nested_zf, nested_fp):
+                assert nested_fp is spool
+                assert nested_zf.read("A_full_5min.txt") == BARS
+
+
+def test_stored_zip_inside_deflated_zip(tmp_path):
+    deep = _zip_bytes({"A_full_5min.txt": BARS})
+    middle = _zip_bytes({"deep.zip": deep}, zipfile.ZIP_STORED)
+    outer_path = _outer(tmp_path, middle, zipfile.ZIP_DEFLATED)
+
+    with open(outer_path, "rb") as fp, zipfile.ZipFile(fp) as zf:
+        with tempfile.SpooledTemporaryFile() as spool1, tempfile.SpooledTemporaryFile() as spool2:
+            with open_nested_zip(zf, fp, zf.getinfo("nested.zip"), spool1) as (mid_zf, mid_fp):
+                assert mid_fp is spool1
+                deep_info = mid_zf.getinfo("deep.zip")
+                with open_nested_zip(mid_zf, mid_fp, deep_info, spool2) as (deep_zf, deep_fp):
+                    # Window over the spool the middle layer was inflated into
+                    assert isinstance(deep_fp, ZipMemberWindow)
+                    assert deep_zf.read("A_full_5min.txt") == BARS
+
+
+def test_local_header_extra_field_is_skipped(tmp_path):
+    nested = _zip_bytes({"A_full_5min.txt": BARS})
+    info = zipfile.ZipInfo("nested.zip")
+    # Unknown extra block (id 0xCAFE, 8 bytes), written to the local header
+    info.extra = struct.pack("<2H", 0xCAFE, 8) + b"padding!"
+    outer_path = tmp_path / "outer.zip"
+    with zipfile.ZipFile(outer_path, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr(info, nested)
+
+    with open(outer_path, "rb") as fp:
+        fp.seek(28)
+        assert struct.unpack("<H", fp.read(2))[0] == len(info.extra)
+    assert _list_nested(outer_path) == ["A_full_5min.txt"]
+
+
+def test_encrypted_stored_member_falls_back_to_spool(tmp_path):
+    nested = _zip_bytes({"A_full_5min.txt": BARS})
+    outer_path = tmp_path / "outer.zip"
+    outer_path.write_bytes(_zipcrypto_zip("nested.zip", nested, b"secret"))
+
+    with open(outer_path, "rb") as fp, zipfile.ZipFile(fp) as zf:
+        zf.setpassword(b"secret")
+        info = zf.getinfo("nested.zip")
+        assert info.compress_type == zipfile.ZIP_STORED and info.flag_bits & 0x1
+        with tempfile.SpooledTemporaryFile() as spool:
+            # The raw bytes are ciphertext, so it must be decrypted via zf.open
+            with open_nested_zip(zf, fp, info, spool) as (nested_zf, nested_fp):
+                assert nested_fp is spool
+                assert nested_zf.read("A_full_5min.txt") == BARS
+
+
+def test_empty_nested_zip_lists_nothing(tmp_path):
+    # Just the 22-byte end record: zipfile probes for a zip64 locator before
+    # the start of the window, which must read as "not there"
+    empty = _zip_bytes({})
+    assert len(empty) == 22
+    assert _list_nested(_outer(tmp_path, empty)) == []
+
+
+@pytest.mark.parametrize("keep", [10, 100, -5])
+def test_truncated_nested_zip_is_bad_zip(tmp_path, keep):
+    data = _zip_bytes({"A_full_5min.txt": BARS})[:keep]
+    with pytest.raises(zipfile.BadZipFile):
+        _list_nested(_outer(tmp_path, data))
+
+
+@pytest.fixture
+def query_api(tmp_path, monkeypatch):
+    pytest.importorskip("pandas")
+    pytest.importorskip("flask")
+    # query_api reads etl_tmp/manifest.json from the working directory on import
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "etl_tmp").mkdir()
+    (tmp_path / "etl_tmp" / "manifest.json").write_text(
+        json.dumps({"files": [], "all_tags": [], "tag_counts": {}})
+    )
+    spec = importlib.util.spec_from_file_location("query_api", ETL_DIR / "query_api.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_load_csv_from_manifest_entry_matches_bytesio_path(query_api, tmp_path):
+    import pandas as pd
+
+    deep = _zip_bytes({"A_full_5min.txt": BARS})
+    outer_path = tmp_path / "outer.zip"
+    with zipfile.ZipFile(outer_path, "w") as zf:
+        zf.writestr("C_full_5min.txt", BARS, zipfile.ZIP_DEFLATED)
+        zf.writestr("stored.zip", deep, zipfile.ZIP_STORED)
+        zf.writestr("deflated.zip", deep, zipfile.ZIP_DEFLATED)
+        zf.writestr("two.zip", _zip_bytes({"deep.zip": deep}), zipfile.ZIP_DEFLATED)
+
+    expected = query_api._read_bars(io.BytesIO(BARS))
+    assert len(expected) == 6
+    for inner in (
+        "C_full_5min.txt",
+        "stored.zip!A_full_5min.txt",
+        "deflated.zip!A_full_5min.txt",
+        "two.zip!deep.zip!A_full_5min.txt",
+    ):
+        df = query_api.load_csv_from_manifest_entry({"path": f"{outer_path}!{inner}"})
+        pd.testing.assert_frame_equal(df, expected)
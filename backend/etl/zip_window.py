@@ -0,0 +1,113 @@
+"""
+zip_window.py - Open zips nested inside other zips without re-reading them
+
+Shared by 0_ingest.py (listing nested company zips) and query_api.py (reading
+bars out of them).
+"""
+
+import errno
+import io
+import shutil
+import struct
+import zipfile
+from contextlib import contextmanager
+
+# Local file header: signature, versions/flags/method/time/date, crc, sizes,
+# then the filename and extra-field lengths that precede the member's data
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_HEADER_SIG = b"PK\x03\x04"
+
+
+class ZipMemberWindow(io.RawIOBase):
+    """
+    Seekable, read-only view of bytes [start, start + size) of `fp`.
+
+    Seeks only move an offset, and each read goes straight to `fp`, so
+    ZipFile's backward seeks (end record, central directory, member headers)
+    cost nothing extra. A ZipExtFile, by contrast, re-reads the member from
+    its start on every backward seek.
+    """
+
+    def __init__(self, fp, start: int, size: int):
+        super().__init__()
+        self._fp = fp
+        self._start = start
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"invalid whence: {whence}")
+        if pos < 0:
+            # OSError like a real file: zipfile probes backwards from the end
+            # for the zip64 locator and only treats OSError as "not there"
+            raise OSError(errno.EINVAL, f"negative seek position: {pos}")
+        self._pos = pos
+        return pos
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self._size - self._pos)
+        if n <= 0:
+            return 0
+        self._fp.seek(self._start + self._pos)
+        n = self._fp.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+
+def stored_member_window(fp, info: zipfile.ZipInfo) -> ZipMemberWindow:
+    """
+    Window over the raw bytes of stored member `info`, read from `fp`, the
+    seekable file its zip was opened on.
+    """
+    fp.seek(info.header_offset)
+    header = fp.read(_LOCAL_HEADER.size)
+    if len(header) != _LOCAL_HEADER.size:
+        raise zipfile.BadZipFile(f"Truncated local header: {info.filename}")
+    fields = _LOCAL_HEADER.unpack(header)
+    if fields[0] != _LOCAL_HEADER_SIG:
+        raise zipfile.BadZipFile(f"Bad local header magic: {info.filename}")
+    data_start = info.header_offset + _LOCAL_HEADER.size + fields[9] + fields[10]
+    return ZipMemberWindow(fp, data_start, info.compress_size)
+
+
+@contextmanager
+def open_nested_zip(zf: zipfile.ZipFile, fp, info: zipfile.ZipInfo, spool):
+    """
+    Open member `info` of `zf`, itself a zip, as a ZipFile.
+
+    `fp` is the seekable file `zf` was opened on. Stored, unencrypted members
+    are read in place through a window on `fp`, so only the nested end record
+    and central directory (plus whatever members the caller opens) are read.
+    Other members are inflated once into `spool`, a truncatable file the
+    caller owns and may reuse, since a deflate stream cannot seek.
+
+    Yields (nested_zf, nested_fp); pass nested_fp to open a zip nested in turn.
+    """
+    if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+        nested_fp = stored_member_window(fp, info)
+    else:
+        spool.seek(0)
+        spool.truncate()
+        with zf.open(info, "r") as member:
+            shutil.copyfileobj(member, spool)
+        spool.seek(0)
+        nested_fp = spool
+
+    with zipfile.ZipFile(nested_fp, "r") as nested_zf:
+        yield nested_zf, nested_fp